@@ -1,5 +1,42 @@
+import functools
+import re
+from collections import OrderedDict, deque, namedtuple
+from operator import attrgetter
+import numpy as np
 import pandas as pd
-from datetime import date, timedelta, datetime
+from pandas.api.types import is_list_like, is_string_dtype
+from datetime import date, datetime, timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_DATE_RE = re.compile(r'^(LAST|NEXT)_(\d+)_DAYS$')
+_ISO_DATE_RE = re.compile(r'^\d{4}-\d{1,2}-\d{1,2}$')
+
+# Characters with a special meaning in a regex. Patterns without any of them are matched as plain substrings
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+# NaT as stored in the int64 view of a datetime64 array
+_NAT = np.iinfo(np.int64).min
+
+# Logical operators, that start a nested expression
+_OPS = frozenset({'AND', 'OR', 'NOT'})
+
+# Operators by opcode, as used in a CompiledRule
+OPERATORS = ('AND', 'OR', 'NOT', 'greater_than', 'greater_equal_than', 'less_than', 'less_equal_than', 'equal_to',
+             'is_in', 'contains', 'earlier_than', 'later_than')
+OPCODES = {operator: opcode for opcode, operator in enumerate(OPERATORS)}
+
+# A filter rule compiled by DataFrameFilter.compile. Expressions have children, comparisons a column and a value
+CompiledRule = namedtuple('CompiledRule', ['op', 'column', 'value', 'children', 'cost'])
 
 class DataFrameFilter:
     """
@@ -16,8 +53,59 @@ class DataFrameFilter:
     Please refer to the rules.py file for some examples.
     """
 
-    def __init__(self, data: pd.DataFrame):
+    # Static cost of each comparison operator, used to order the criteria of AND/OR operators (cheapest first)
+    # Nested expressions cost the sum of their criteria. Operators not listed here cost 3
+    selectivity_hint = {
+        'equal_to': 1,
+        'is_in': 2,
+        'greater_than': 3,
+        'greater_equal_than': 3,
+        'less_than': 3,
+        'less_equal_than': 3,
+        'earlier_than': 4,
+        'later_than': 4,
+        'contains': 10
+    }
+
+    # Operators that can be compiled into a Numba kernel, and their Python equivalent
+    compiled_operators = {
+        'greater_than': '>',
+        'greater_equal_than': '>=',
+        'less_than': '<',
+        'less_equal_than': '<=',
+        'equal_to': '==',
+        'earlier_than': '<',
+        'later_than': '>'
+    }
+
+    # Minimum number of rows for a filter to be compiled into a Numba kernel, when jit is enabled
+    jit_min_rows = 1_000_000
+
+    # Cost of selecting a single row, in the same units as selectivity_hint. Short-circuited AND/OR only select the
+    # remaining rows to evaluate a criteria when that's cheaper than evaluating it on all rows and combining the masks
+    gather_cost = 16
+
+    # Maximum nesting depth of a filter to be compiled into a Numba kernel, as the generated code is parsed by Python
+    compile_max_depth = 100
+
+    # Numba kernels already compiled, by kernel body, least recently used first. Shared by all instances, as values
+    # are passed as arguments. At most jit_cache_size kernels are kept
+    _kernels = OrderedDict()
+    jit_cache_size = 128
+
+    def __init__(self, data: pd.DataFrame, jit: bool = False):
+        """
+        jit enables compiling numeric/date filters into parallel Numba kernels on dataframes with at least
+        jit_min_rows rows. Each new filter shape costs a compilation (hundreds of ms), so it only pays off when the
+        same rules are applied many times
+        """
+
+        if jit and numba is None:
+            raise ImportError('numba is required to use jit=True')
+
         self.data = data
+        self.jit = jit
+        self._regex_cache: dict[str, re.Pattern] = {}
         self.functions_dict = {
             'AND': self.AND,
             'NOT': self.NOT,
@@ -32,6 +120,10 @@ class DataFrameFilter:
             'earlier_than': self.earlier_than,
             'later_than': self.later_than
         }
+        # Same functions indexed by opcode, to evaluate a CompiledRule
+        self._dispatch = tuple(self.functions_dict[operator] for operator in OPERATORS)
+        # Generators evaluating each logical operator step by step, indexed by opcode, see _eval_mask
+        self._steps = {OPCODES['AND']: self._and_steps, OPCODES['OR']: self._or_steps, OPCODES['NOT']: self._not_steps}
 
     @staticmethod
     def greater_than(a, b) -> bool:
@@ -68,34 +160,108 @@ class DataFrameFilter:
         """
         IS IN operator. Is A in B?
         Overwrites is_in function inherited from BasicOperators, as dataframe filtering using is_in uses a different syntax
+        For categorical columns, B is translated to a set of category codes, which are then looked up vectorized
         """
 
-        return a.isin(b)
+        # Values that are not list-like (i.e. a string) are rejected by Series.isin with a TypeError
+        if not isinstance(a.dtype, pd.CategoricalDtype) or not is_list_like(b):
+            return a.isin(b)
 
-    @staticmethod
-    def contains(a, b) -> bool:
+        values = list(b)
+        allowed_codes = a.cat.categories.get_indexer(values)
+        allowed_codes = allowed_codes[allowed_codes >= 0]
+        if pd.isna(values).any():
+            # Missing values are stored with code -1
+            allowed_codes = np.append(allowed_codes, -1)
+
+        return pd.Series(np.isin(a.cat.codes.to_numpy(), allowed_codes), index=a.index)
+
+    def contains(self, a, b) -> bool:
         """
         Contains operator. Does A contain B?
+        B is compiled as a regex once and cached. String columns are not converted, and Arrow backed ones
+        are matched directly with pyarrow compute: as a plain substring search when B has no regex special characters,
+        or else with Arrow's regex engine (RE2)
+        """
+
+        if self._is_arrow_string(a):
+            try:
+                if isinstance(b, str) and _REGEX_SPECIAL_CHARS.isdisjoint(b):
+                    matches = pc.match_substring(a.array._pa_array, b)
+                else:
+                    matches = pc.match_substring_regex(a.array._pa_array, b)
+                matches = matches.fill_null(False)
+                return pd.Series(matches.to_numpy(zero_copy_only=False), index=a.index)
+            except pa.ArrowInvalid:
+                # Pattern not supported by Arrow's regex engine (RE2), fall back to Python's
+                a = a.astype(object)
+
+        pattern = self._regex_cache.get(b)
+        if pattern is None:
+            pattern = self._regex_cache[b] = re.compile(b)
+
+        if not is_string_dtype(a):
+            a = a.astype(str)
+        return a.str.contains(pattern, regex=True, na=False)
+
+    @staticmethod
+    def _is_arrow_string(a: pd.Series) -> bool:
+        """
+        Check if a column is a string column backed by a pyarrow array
         """
 
-        return a.astype(str).str.contains(b)
+        if pc is None:
+            return False
+        if isinstance(a.dtype, pd.ArrowDtype):
+            return pa.types.is_string(a.dtype.pyarrow_dtype) or pa.types.is_large_string(a.dtype.pyarrow_dtype)
+        return isinstance(a.dtype, pd.StringDtype) and a.dtype.storage == 'pyarrow'
 
     def later_than(self, a, b) -> bool:
         """
         Later than date operator. Returns True if a is later than b
         """
 
-        return a > self._convert_date(b)
+        b = self._convert_date(b)
+        epoch = self._epoch(a, b)
+        if epoch is None:
+            return a > b
+        values, b_value = epoch
+        return pd.Series(values > b_value, index=a.index)
 
     def earlier_than(self, a, b) -> bool:
         """
         Earlier than date operator. Returns True if a is earlier than b
         """
 
-        return a < self._convert_date(b)
+        b = self._convert_date(b)
+        epoch = self._epoch(a, b)
+        if epoch is None:
+            return a < b
+        values, b_value = epoch
+        return pd.Series((values < b_value) & (values != _NAT), index=a.index)
+
+    @staticmethod
+    def _epoch(a: pd.Series, b: pd.Timestamp) -> tuple:
+        """
+        View a datetime column as int64 since epoch, in the column's own unit, together with b in that same unit,
+        so they can be compared as plain integers without converting the column
+        Returns None when that isn't possible: timezone aware dates, non datetime64 columns, or b not representable
+        exactly in the column's unit (out of bounds, or more precise than the unit)
+        """
+
+        if b.tz is not None or not isinstance(a.dtype, np.dtype) or a.dtype.kind != 'M':
+            return None
+
+        unit = np.datetime_data(a.dtype)[0]
+        try:
+            b_value = b.as_unit(unit, round_ok=False).asm8.view('i8')
+        except ValueError:
+            # OutOfBoundsDatetime is a ValueError as well
+            return None
+        return a.to_numpy().view('i8'), b_value
 
     @staticmethod
-    def _convert_date(value: str) -> date:
+    def _convert_date(value) -> pd.Timestamp:
         """
         Convert the value used in a JSON rule to a valid date object.
         Some of the supported values are:
@@ -103,131 +269,447 @@ class DataFrameFilter:
             LAST_X_DAYS
             NEXT_X_DAYS
         Plus dates as string in iso format: YYYY-MM-DD (i.e. 2023, March 30th = 2023-03-30)
+        Values already converted (i.e. by _resolve_constants) are returned as they are
         """
 
-        date_mapping = {
-            'TODAY': pd.to_datetime(date.today())
-            }
+        if isinstance(value, date):
+            return pd.Timestamp(value)
 
-        if value in date_mapping.keys():
-            return date_mapping[value]
+        # Parsed values are cached per day, as relative dates (TODAY, LAST_X_DAYS...) change every day
+        return DataFrameFilter._parse_date(value, date.today())
 
-        # Check if value is LAST/NEXT_DAYS
-        if '_DAYS' in value:
-            if 'LAST_' in value:
-                days = int(value.split('LAST_')[1].split('_DAYS')[0])
-                return pd.to_datetime(date.today() - timedelta(days=days))
-            elif 'NEXT_' in value:
-                days = int(value.split('NEXT_')[1].split('_DAYS')[0])
-                return pd.to_datetime(date.today() + timedelta(days=days))
-            else:
-                raise Exception(f'Invalid date value. Value passed: {value}')
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _parse_date(value: str, today: date) -> pd.Timestamp:
+        """
+        Parse a date value used in a JSON rule, relative to the given day. See _convert_date
+        """
 
-        # Finally tries to parse value as an ISO format date
-        try:
-            return pd.to_datetime(datetime.strptime(value, '%Y-%m-%d').date())
-        except:
-            pass
+        if value == 'TODAY':
+            return pd.Timestamp(today)
+
+        # Check if value is LAST/NEXT_X_DAYS
+        match = _DATE_RE.match(value)
+        if match:
+            days = timedelta(days=int(match.group(2)))
+            return pd.Timestamp(today - days if match.group(1) == 'LAST' else today + days)
+
+        # Finally parses value as an ISO format date
+        if _ISO_DATE_RE.match(value):
+            try:
+                return pd.Timestamp(datetime.strptime(value, '%Y-%m-%d'))
+            except ValueError:
+                # i.e. month 13
+                pass
 
         # If passed value doesn't match any of the above, then an exception is raised
-        raise Exception('Invalid date value passed')
+        raise Exception(f'Invalid date value. Value passed: {value}')
+
+    def _resolve_constants(self, expression):
+        """
+        Return a copy of an expression where the values of date comparisons are already converted to dates,
+        so they are parsed once per filter call instead of once per evaluation
+        """
+
+        # Explicit stack of (copied list, position) pairs, so deep trees can't hit the recursion limit
+        root = [expression]
+        stack = deque([(root, 0)])
+        while stack:
+            parent, i = stack.pop()
+            node = parent[i]
+            if isinstance(node, dict) and node['comparison_operator'] in ('earlier_than', 'later_than'):
+                parent[i] = {**node, 'value_to_compare': self._convert_date(node['value_to_compare'])}
+            elif isinstance(node, (list, tuple)):
+                parent[i] = copy = list(node)
+                stack.extend((copy, j) for j in range(len(copy)))
+        return root[0]
+
+    def _index(self, rows: np.ndarray = None) -> pd.Index:
+        """
+        Index of the subset of rows (positions in self.data) being evaluated. None means all rows
+        """
+
+        return self.data.index if rows is None else self.data.index[rows]
+
+    def _positions(self, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Positions in self.data of the subset of rows being evaluated. None means all rows
+        """
+
+        return np.arange(len(self.data)) if rows is None else rows
+
+    def _eval_on_subset(self, arg: CompiledRule, rows: np.ndarray = None) -> pd.Series:
+        """
+        Evaluate a single compiled comparison only on a subset of rows, given as positions in self.data. None means all
+        rows
+        Returns a filter mask in pd.Series format, with one element per row of the subset
+        """
+
+        value_to_compare = self.data[arg.column]
+        if rows is not None and len(rows) < len(self.data):
+            value_to_compare = value_to_compare.iloc[rows]
+        return self._dispatch[arg.op](value_to_compare, arg.value)
 
     @staticmethod
-    def __dot(filter_masks: list) -> list:
+    def _nested(arg) -> tuple:
         """
-        Apply an AND operation on a list of pandas filter masks, using dot product
-        (Dot product of booleans is the same as AND)
+        Logical operator and criteria of a nested expression, or None if arg is a single comparison
+        A nested expression (a list or a tuple) starts with a logical operator, or with a criteria when AND is implied
         """
 
-        result = filter_masks[0]
-        for i in range(1, len(filter_masks)):
-            arg = filter_masks[i]
-            result *= arg
-        return result
+        if isinstance(arg, (list, tuple)):
+            if isinstance(arg[0], (list, tuple, dict)):
+                return 'AND', arg
+            if arg[0] in _OPS:
+                return arg[0], arg[1:]
+        return None
+
+    @staticmethod
+    def _selectivity_order(args: list) -> list:
+        """
+        Sort the criteria of an AND/OR operator so cheap, selective comparisons (equal_to, is_in) are evaluated first,
+        and expensive ones (i.e. contains, which uses a regex) are evaluated last, on as few rows as possible
+        The cost of each criteria is computed once when compiling it, based on the selectivity_hint table
+        """
+
+        return sorted(args, key=attrgetter('cost'))
 
     @staticmethod
-    def __sum(filter_masks: list) -> bool:
+    def _extract_conjuncts(args) -> list:
         """
-        Apply an OR operation on a list of pandas filter masks, using sum
-        (SUM of booleans is the same as OR)
+        Flatten the compiled criteria of nested AND expressions into a single list of conjuncts
+        i.e.: [A, ['AND', B, ['AND', C, D]]] -> [A, B, C, D]
         """
 
-        result = filter_masks[0]
-        for i in range(1, len(filter_masks)):
-            arg = filter_masks[i]
-            result += arg
+        # Explicit stack of iterators over the criteria of each AND being flattened, so deep trees can't hit the
+        # recursion limit
+        conjuncts = []
+        stack = deque([iter(args)])
+        while stack:
+            for arg in stack[-1]:
+                if arg.op == OPCODES['AND']:
+                    stack.append(iter(arg.children))
+                    break
+                conjuncts.append(arg)
+            else:
+                stack.pop()
+        return conjuncts
+
+    def AND(self, *args, rows: np.ndarray = None) -> pd.Series:
+        """
+        AND operator. Short-circuited: once few rows are left, each criteria is only evaluated on the rows that passed
+        the previous ones.
+        Nested AND expressions are flattened, so the cheapest criteria of the whole tree is pushed down and applied first.
+        """
+
+        return pd.Series(self._eval_mask(['AND', *args], rows), index=self._index(rows))
+
+    def OR(self, *args, rows: np.ndarray = None) -> pd.Series:
+        """
+        OR operator. Short-circuited: once few rows are left, each criteria is only evaluated on the rows not matched by
+        the previous ones.
+        """
+
+        return pd.Series(self._eval_mask(['OR', *args], rows), index=self._index(rows))
+
+    def NOT(self, *args, rows: np.ndarray = None) -> pd.Series:
+        """
+        NOT operator. Negates a list of dataframe filter masks, using a bitwise NOT
+        Missing values (NA) don't match the criteria, so they are selected by its negation, as NaN/NaT already are
+        """
+
+        return pd.Series(self._eval_mask(['NOT', *args], rows), index=self._index(rows))
+
+    def _and_steps(self, args, rows: np.ndarray = None):
+        """
+        Steps of the AND operator, see AND and _eval_mask
+        """
+
+        result = np.ones(len(self._index(rows)), dtype=bool)
+        for arg in self._selectivity_order(self._extract_conjuncts(args)):
+            current_idx = self._survivors(result, arg)
+            if current_idx is None:
+                np.logical_and(result, (yield arg, rows), out=result)
+            else:
+                result[current_idx[~(yield arg, self._positions(rows)[current_idx])]] = False
         return result
 
-    def __filter(self, args: list) -> list:
+    def _or_steps(self, args, rows: np.ndarray = None):
         """
-        Helper function to handle dataframe filtering based on a list of criteria
-        i.e.: ['OR', ['sub_business_entity', 'equal_to', 'Network Security'], ['sub_business_entity', 'equal_to', 'Security Endpoints']]
-        Returns a list of filter masks in pd.Series format
+        Steps of the OR operator, see OR and _eval_mask
         """
 
-        results = []
-        for arg in args:
-            if isinstance(arg, pd.Series):
-                results.append(arg)
+        result = np.zeros(len(self._index(rows)), dtype=bool)
+        for arg in self._selectivity_order(args):
+            unmatched_idx = self._survivors(~result, arg)
+            if unmatched_idx is None:
+                np.logical_or(result, (yield arg, rows), out=result)
             else:
-                rule = self.functions_dict[arg['comparison_operator']]
-                value_to_compare = self.data[arg['key_to_compare']]
-                results.append(rule(value_to_compare, arg['value_to_compare']))
+                result[unmatched_idx[(yield arg, self._positions(rows)[unmatched_idx])]] = True
+        return result
+
+    def _not_steps(self, args, rows: np.ndarray = None):
+        """
+        Steps of the NOT operator, see NOT and _eval_mask
+        """
 
-        return results
+        return ~(yield args[0], rows)
 
-    def AND(self, *args) -> pd.Series:
+    def _survivors(self, mask: np.ndarray, arg) -> np.ndarray:
         """
-        AND operator. Dot product is applied on a list of dataframe filter masks (Product of booleans = AND)
+        Positions of the rows still to be evaluated by a short-circuited AND/OR, or None while they are too many for
+        the next criteria: selecting them would cost more than evaluating it on all rows (see gather_cost)
         """
 
-        results = self.__filter(args)
-        return self.__dot(results)
+        cost = arg.cost
+        count = np.count_nonzero(mask)
+        if count * (self.gather_cost + cost) >= len(mask) * cost:
+            return None
+        return np.flatnonzero(mask)
 
-    def OR(self, *args) -> pd.Series:
+    def _eval_mask(self, arg, rows: np.ndarray = None) -> np.ndarray:
         """
-        AND operator. Sum operation is applied on a list of dataframe filter masks (Sum of booleans = OR)
+        Evaluate a single criteria (a comparison or a nested expression) on a subset of rows, as a boolean numpy array
+        where missing values are False
+        JSON criteria are compiled first (see compile), so the cost of each nested expression is only computed once
+        Nested expressions are evaluated with an explicit stack of the AND/OR/NOT operators in progress instead of
+        recursive calls, so deep trees can't hit the recursion limit. Each operator is a generator (see _and_steps),
+        that yields the criteria it needs evaluated together with the rows to evaluate them on, and is sent back their
+        masks. Once done, it returns its own mask
         """
 
-        results = self.__filter(args)
-        return self.__sum(results)
+        if not isinstance(arg, CompiledRule):
+            arg = self._compile_rule(arg)
+
+        operators = []
+        while True:
+            steps = self._steps.get(arg.op)
+            if steps is None:
+                mask = self._eval_on_subset(arg, rows).to_numpy(dtype=bool, na_value=False)
+            else:
+                operators.append(steps(arg.children, rows))
+                mask = None
+
+            # Send the mask to the operator that asked for it, until one asks for another criteria
+            while operators:
+                try:
+                    arg, rows = operators[-1].send(mask)
+                    break
+                except StopIteration as done:
+                    operators.pop()
+                    mask = done.value
+            else:
+                return mask
 
-    def NOT(self, *args) -> pd.Series:
+    def _jit_compile(self, expression, args: list) -> str:
         """
-        NOT operator. Negates a list of dataframe filter masks
+        Compile an expression into the body of a Numba kernel evaluating a single row i, i.e.:
+            ['AND', {Quantity greater_than 40}, {Price less_than 5}] -> ((a0[i] > a1) and (a2[i] < a3))
+        Column arrays and values are appended to args, with dates as int64 in the column's own unit. Returns None if any
+        part of the expression can't be compiled: comparisons not listed in compiled_operators, done on columns that
+        aren't numpy numeric/datetime64 (i.e. strings, nullable dtypes), or with values that don't fit in 64 bits
         """
 
-        results = self.__filter(args)
-        return results[0].apply(lambda x: not x)
+        if isinstance(expression, dict):
+            operator = self.compiled_operators.get(expression['comparison_operator'])
+            if operator is None:
+                return None
+
+            column = self.data[expression['key_to_compare']]
+            value = expression['value_to_compare']
+            if not isinstance(column.dtype, np.dtype):
+                return None
+            if expression['comparison_operator'] in ('earlier_than', 'later_than'):
+                epoch = self._epoch(column, self._convert_date(value))
+                if epoch is None:
+                    return None
+                array, value = epoch
+                # NaT is stored as the smallest int64, and never matches a date comparison
+                guard = f'a{len(args)}[i] != {_NAT} and '
+            elif column.dtype.kind in 'iuf' and isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and np.min_scalar_type(value).kind != 'O':
+                # Integers that don't fit in 64 bits (object scalar type) can't be typed by Numba
+                array = column.to_numpy()
+                guard = ''
+            else:
+                return None
+
+            args.extend((array, value))
+            return f'({guard}a{len(args) - 2}[i] {operator} a{len(args) - 1})'
+
+        if isinstance(expression[0], (list, tuple, dict)):
+            operation, children = 'AND', expression
+        else:
+            operation, children = expression[0], expression[1:]
+
+        compiled = [self._jit_compile(arg, args) for arg in children]
+        if None in compiled or operation not in _OPS:
+            return None
+        if operation == 'NOT':
+            return f'(not {compiled[0]})'
+        return '(' + (' and ' if operation == 'AND' else ' or ').join(compiled) + ')'
 
-    def filter(self, filters_json) -> pd.DataFrame:
+    def _jit_kernel(self, body: str, n_args: int):
         """
-        Filter a dataframe using a series of filters structured as a JSON.
-        Example:
-            ['AND', ['sub_business_entity', 'equal_to', 'Ent. Switching'], ['last_support_date', 'earlier_than', 'TODAY']
-        equals to:
-            items where sub_business_entity == Ent. Switching AND last_support_date earlier than TODAY
+        Get the parallel Numba kernel computing a filter mask from a body generated by _jit_compile, compiling it once
+        """
+
+        kernel = self._kernels.get(body)
+        if kernel is not None:
+            self._kernels.move_to_end(body)
+        else:
+            params = ''.join(f'a{i}, ' for i in range(n_args))
+            source = (f'def kernel({params}n):\n'
+                      f'    out = np.empty(n, np.bool_)\n'
+                      f'    for i in prange(n):\n'
+                      f'        out[i] = {body}\n'
+                      f'    return out\n')
+            namespace = {'np': np, 'prange': numba.prange}
+            exec(source, namespace)
+            kernel = self._kernels[body] = numba.njit(parallel=True)(namespace['kernel'])
+            if len(self._kernels) > self.jit_cache_size:
+                self._kernels.popitem(last=False)
+        return kernel
+
+    def _compiled_mask(self, filters_json) -> np.ndarray:
+        """
+        Evaluate the filters in a single pass over the data with a Numba kernel, when jit is enabled, the dataframe is
+        very large and the filters can be compiled. Returns a boolean numpy array, or None otherwise
+        """
+
+        if self.jit and len(self.data) >= self.jit_min_rows and self._depth(filters_json) <= self.compile_max_depth:
+            args = []
+            body = self._jit_compile(filters_json, args)
+            if body is not None:
+                return self._jit_kernel(body, len(args))(*args, len(self.data))
+
+        return None
+
+    @staticmethod
+    def _depth(expression) -> int:
+        """
+        Nesting depth of an expression. A single comparison has depth 0
         """
 
-        filter_masks = self.evaluate_expression(filters_json)
-        return self.data[filter_masks]
+        depth = 0
+        stack = deque([(expression, 0)])
+        while stack:
+            node, level = stack.pop()
+            if isinstance(node, (list, tuple)):
+                stack.extend((arg, level + 1) for arg in node)
+            else:
+                depth = max(depth, level)
+        return depth
 
-    def evaluate_expression(self, expression: list) -> bool:
+    @staticmethod
+    def _referenced_columns(expression) -> set:
         """
-        Evaluate a list of expressions
+        Collect every key_to_compare used in an expression, including nested ones
         """
 
-        if isinstance(expression[0], list) or isinstance(expression[0], dict):
-            expression.insert(0, 'AND')
+        columns = set()
+        stack = deque([expression])
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                columns.add(node['key_to_compare'])
+            elif isinstance(node, (list, tuple)):
+                stack.extend(node)
+        return columns
+
+    def compile(self, expression) -> CompiledRule:
+        """
+        Compile a filter JSON once, for rules that are applied many times on this dataframe. Operators are replaced by
+        integer opcodes, columns are checked and date values converted in advance, and is_in values are frozen
+        The result can be passed to filter instead of the JSON. Columns are read when filtering, so changes to the
+        dataframe are seen
+        """
 
-        operation = self.functions_dict[expression[0]]
+        self._check_columns(expression)
+        return self._compile_rule(self._resolve_constants(expression))
 
-        args = []
-        for i in range(1, len(expression)):
-            triplet = expression[i]
-            if 'AND' in triplet or 'OR' in triplet or 'NOT' in triplet:
-                args.append(self.evaluate_expression(triplet))
+    def _compile_rule(self, expression) -> CompiledRule:
+        """
+        Helper of compile, also used to evaluate JSON criteria. Criteria already compiled are kept as is
+        Nested expressions are compiled bottom-up with an explicit stack, so deep trees can't hit
+        the recursion limit
+        """
+
+        # Stack of (operator, iterator over its criteria, its compiled children) of the expressions being compiled,
+        # below the one of a root pseudo-expression holding the result
+        root = []
+        stack = deque([(None, iter([expression]), root)])
+        while stack:
+            for arg in stack[-1][1]:
+                if isinstance(arg, CompiledRule):
+                    stack[-1][2].append(arg)
+                    continue
+                nested = self._nested(arg)
+                if nested is not None:
+                    stack.append((nested[0], iter(nested[1]), []))
+                    break
+
+                operator = arg['comparison_operator']
+                value = arg['value_to_compare']
+                if operator == 'is_in' and is_list_like(value):
+                    value = frozenset(value)
+                stack[-1][2].append(CompiledRule(op=OPCODES[operator],
+                                                 column=arg['key_to_compare'],
+                                                 value=value,
+                                                 children=(),
+                                                 cost=self.selectivity_hint.get(operator, 3)))
             else:
-                args.append(triplet)
+                operator, _, children = stack.pop()
+                if stack:
+                    stack[-1][2].append(CompiledRule(op=OPCODES[operator], column=None, value=None,
+                                                     children=tuple(children),
+                                                     cost=sum(child.cost for child in children)))
+        return root[0]
+
+    def _check_columns(self, expression):
+        """
+        Raise a KeyError listing every column used by an expression that isn't in the dataframe
+        """
+
+        missing = self._referenced_columns(expression).difference(self.data.columns)
+        if missing:
+            raise KeyError(f'Columns not found in dataframe: {sorted(missing, key=str)}')
+
+    def filter(self, filters_json, columns: list | str = None) -> pd.DataFrame:
+        """
+        Filter a dataframe using a series of filters structured as a JSON.
+        Example:
+            ['AND', ['sub_business_entity', 'equal_to', 'Ent. Switching'], ['last_support_date', 'earlier_than', 'TODAY']
+        equals to:
+            items where sub_business_entity == Ent. Switching AND last_support_date earlier than TODAY
+        Only the columns referenced by the filters are read to evaluate them. If columns is given (a list of column
+        names, or a single one), only those columns are returned, so the unused ones are never copied
+        With jit enabled, on very large dataframes, filters made only of numeric and date comparisons are compiled into
+        a parallel Numba kernel evaluated in one pass, without allocating a filter mask per comparison
+        filters_json can also be a rule already compiled with the compile method
+        """
+
+        # A plain numpy mask avoids aligning the index of the filter mask with the one of the dataframe
+        if isinstance(filters_json, CompiledRule):
+            mask_arr = self._eval_mask(filters_json)
+        else:
+            self._check_columns(filters_json)
+            filters_json = self._resolve_constants(filters_json)
+
+            mask_arr = self._compiled_mask(filters_json)
+            if mask_arr is None:
+                mask_arr = self._eval_mask(filters_json)
+        if columns is None:
+            return self.data.iloc[mask_arr]
+        if isinstance(columns, str) or not is_list_like(columns):
+            columns = [columns]
+        return self.data.loc[mask_arr, list(columns)]
+
+    def evaluate_expression(self, expression: list, rows: np.ndarray = None) -> pd.Series:
+        """
+        Evaluate a list of expressions, optionally only on a subset of rows (positions in self.data)
+        Nested expressions are passed unevaluated to the AND/OR/NOT operators, so they can be short-circuited
+        The expression is never modified: a missing operator at the start of the list is read as AND
+        """
 
-        return operation(*args)
+        return pd.Series(self._eval_mask(expression, rows), index=self._index(rows))
@@ -0,0 +1,271 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rules
+from dataframe_filtering import DataFrameFilter
+
+
+def criteria(key, operator, value):
+    return dict(key_to_compare=key, comparison_operator=operator, value_to_compare=value)
+
+
+def matches(condition: pd.Series) -> pd.Series:
+    """
+    Missing values never match a comparison
+    """
+
+    return condition.fillna(False).astype(bool)
+
+
+@pytest.fixture(scope='module')
+def df() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 300
+    invoice_dates = pd.Series(pd.Timestamp('2010-06-01') + pd.to_timedelta(rng.integers(0, 6000, n), unit='D'))
+    invoice_dates = invoice_dates.astype('datetime64[us]')
+    invoice_dates[::17] = pd.NaT
+    invoice_dates[5::23] = pd.Timestamp('2500-01-01')
+    quantity_na = pd.array(rng.integers(0, 100, n), dtype='Int64')
+    quantity_na[::7] = pd.NA
+    price_na = pd.array(rng.random(n) * 10, dtype='Float64')
+    price_na[::11] = pd.NA
+    price = rng.random(n) * 10
+    price[::13] = np.nan
+    descriptions = rng.choice(['RED LANTERN', 'blue cup', 'LANTERN big', 'plate', None], n)
+
+    return pd.DataFrame({
+        'Country': rng.choice(['United Kingdom', 'France', 'Germany', None], n),
+        'Quantity': rng.integers(0, 100, n),
+        'QuantityNA': quantity_na,
+        'Price': price,
+        'PriceNA': price_na,
+        'Category': pd.Categorical(rng.choice(['small', 'medium', 'large', None], n)),
+        'Description': descriptions,
+        'DescriptionObject': descriptions,
+        'DescriptionPython': pd.array(descriptions, dtype=pd.StringDtype('python')),
+        'InvoiceDate': invoice_dates.to_numpy(),
+        'ShipDate': (pd.Timestamp('2012-01-01') + pd.to_timedelta(rng.integers(0, 5000, n), unit='D')).as_unit('s'),
+    }, index=rng.permutation(n) + 100).astype({'DescriptionObject': object})
+
+
+@pytest.fixture(params=['evaluator', 'short_circuit', 'compiled', 'jit'])
+def apply_filter(request):
+    """
+    Filter a dataframe through each evaluation path, at thresholds small enough for the test data
+    """
+
+    def apply(data, rule, **kwargs):
+        if request.param == 'jit':
+            pytest.importorskip('numba')
+            data_filter = DataFrameFilter(data, jit=True)
+            data_filter.jit_min_rows = 0
+        else:
+            data_filter = DataFrameFilter(data)
+        if request.param == 'short_circuit':
+            # Always evaluate each criteria only on the rows left by the previous ones
+            data_filter.gather_cost = 0
+        if request.param == 'compiled':
+            rule = data_filter.compile(rule)
+        return data_filter.filter(rule, **kwargs)
+
+    return apply
+
+
+def today() -> pd.Timestamp:
+    return pd.Timestamp(date.today())
+
+
+CASES = {
+    'rule_example': (
+        rules.rule_example,
+        lambda df: (matches(df.Country == 'United Kingdom') & matches(df.Quantity > 40))
+        | matches(df.Description.str.contains('LANTERN'))
+    ),
+    'date_example_1': (
+        rules.date_example_1,
+        lambda df: matches(df.Country == 'United Kingdom') & matches(df.InvoiceDate < today())
+        & matches(df.InvoiceDate > pd.Timestamp('2011-01-01'))
+    ),
+    'date_example_2': (
+        rules.date_example_2,
+        lambda df: matches(df.Country == 'United Kingdom') & matches(df.InvoiceDate < today() - timedelta(days=30))
+        & matches(df.InvoiceDate > pd.Timestamp('2011-01-01'))
+    ),
+    'implicit_and': (
+        [criteria('Quantity', 'greater_equal_than', 10), criteria('Quantity', 'less_equal_than', 60),
+         criteria('Price', 'less_than', 5)],
+        lambda df: matches(df.Quantity >= 10) & matches(df.Quantity <= 60) & matches(df.Price < 5)
+    ),
+    'nested_and': (
+        ['AND', criteria('Quantity', 'greater_than', 20),
+         ['AND', criteria('Country', 'equal_to', 'France'), ['OR', criteria('Price', 'less_than', 2),
+                                                            criteria('Quantity', 'greater_than', 90)]]],
+        lambda df: matches(df.Quantity > 20) & matches(df.Country == 'France')
+        & (matches(df.Price < 2) | matches(df.Quantity > 90))
+    ),
+    'tuples': (
+        ['OR', ('AND', criteria('Quantity', 'greater_than', 50), criteria('Price', 'less_than', 5)),
+         (criteria('Country', 'equal_to', 'France'), ('NOT', criteria('Quantity', 'greater_than', 10)))],
+        lambda df: (matches(df.Quantity > 50) & matches(df.Price < 5))
+        | (matches(df.Country == 'France') & ~matches(df.Quantity > 10))
+    ),
+    'numeric_nan': (
+        ['NOT', ['OR', criteria('Price', 'greater_than', 7), criteria('Quantity', 'equal_to', 3)]],
+        lambda df: ~(matches(df.Price > 7) | matches(df.Quantity == 3))
+    ),
+    'huge_integers': (
+        ['OR', criteria('Quantity', 'greater_than', 2 ** 70), criteria('Quantity', 'less_than', -2 ** 70),
+         criteria('Quantity', 'greater_equal_than', 2 ** 63), criteria('Quantity', 'equal_to', 7)],
+        lambda df: df.Quantity == 7
+    ),
+    'nullable': (
+        ['OR', criteria('QuantityNA', 'greater_than', 40), criteria('PriceNA', 'less_equal_than', 2)],
+        lambda df: matches(df.QuantityNA > 40) | matches(df.PriceNA <= 2)
+    ),
+    'nullable_not': (
+        ['NOT', ['AND', criteria('QuantityNA', 'less_than', 50), criteria('Price', 'less_than', 5)]],
+        lambda df: ~(matches(df.QuantityNA < 50) & matches(df.Price < 5))
+    ),
+    'nullable_not_single': (
+        ['NOT', criteria('QuantityNA', 'less_than', 50)],
+        lambda df: ~matches(df.QuantityNA < 50)
+    ),
+    'is_in': (
+        ['NOT', criteria('Country', 'is_in', ['France', 'Germany', 'Spain'])],
+        lambda df: ~matches(df.Country.isin(['France', 'Germany', 'Spain']))
+    ),
+    'is_in_categorical': (
+        # 'huge' isn't one of the categories, None matches the missing values
+        [criteria('Category', 'is_in', ['small', 'huge', None])],
+        lambda df: matches(df.Category.isin(['small', 'huge', None]))
+    ),
+    'is_in_categorical_not': (
+        ['NOT', criteria('Category', 'is_in', ('medium', 'large'))],
+        lambda df: ~matches(df.Category.isin(['medium', 'large']))
+    ),
+    'nat': (
+        ['OR', criteria('InvoiceDate', 'earlier_than', '2012-01-01'),
+         ['NOT', criteria('InvoiceDate', 'later_than', '2020-01-01')]],
+        lambda df: matches(df.InvoiceDate < pd.Timestamp('2012-01-01'))
+        | ~matches(df.InvoiceDate > pd.Timestamp('2020-01-01'))
+    ),
+    'seconds_unit': (
+        ['AND', criteria('ShipDate', 'later_than', '2015-06-01'), criteria('ShipDate', 'earlier_than', 'TODAY')],
+        lambda df: matches(df.ShipDate > pd.Timestamp('2015-06-01')) & matches(df.ShipDate < today())
+    ),
+    'out_of_range_dates': (
+        ['AND', criteria('InvoiceDate', 'later_than', '1500-01-01'),
+         criteria('InvoiceDate', 'earlier_than', '3000-01-01')],
+        lambda df: df.InvoiceDate.notna()
+    ),
+    'far_future': (
+        ['OR', criteria('InvoiceDate', 'later_than', 'NEXT_100000_DAYS'),
+         criteria('ShipDate', 'later_than', 'NEXT_100000_DAYS')],
+        lambda df: matches(df.InvoiceDate > today() + timedelta(days=100000))
+    ),
+    'unpadded_date': (
+        [criteria('InvoiceDate', 'later_than', '2020-1-1')],
+        lambda df: matches(df.InvoiceDate > pd.Timestamp('2020-01-01'))
+    ),
+    'contains_regex': (
+        [criteria('Description', 'contains', 'LANT[EA]RN$')],
+        lambda df: matches(df.Description.str.contains('LANT[EA]RN$'))
+    ),
+    'contains_unsupported_by_arrow': (
+        # Lookaheads aren't supported by Arrow's regex engine (RE2), so Python's is used instead
+        [criteria('Description', 'contains', 'LANTERN(?= big)')],
+        lambda df: matches(df.Description.str.contains('LANTERN(?= big)'))
+    ),
+    'contains_object': (
+        ['OR', criteria('DescriptionObject', 'contains', 'LANT[EA]RN$'),
+         criteria('DescriptionObject', 'contains', 'cup')],
+        lambda df: matches(df.DescriptionObject.str.contains('LANT[EA]RN$'))
+        | matches(df.DescriptionObject.str.contains('cup'))
+    ),
+    'contains_python_string': (
+        ['OR', criteria('DescriptionPython', 'contains', 'cup|plate'),
+         criteria('DescriptionPython', 'contains', 'RED')],
+        lambda df: matches(df.DescriptionPython.str.contains('cup|plate'))
+        | matches(df.DescriptionPython.str.contains('RED'))
+    ),
+    'contains_non_string': (
+        [criteria('Quantity', 'contains', '^1')],
+        lambda df: df.Quantity.astype(str).str.contains('^1')
+    ),
+}
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_filter_matches_pandas(df, apply_filter, name):
+    rule, reference = CASES[name]
+    expected = df[reference(df).to_numpy()]
+
+    result = apply_filter(df, rule)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_filter_does_not_modify_rule(df, apply_filter):
+    rule = ['AND', ['OR', criteria('Country', 'equal_to', 'France'), criteria('Quantity', 'less_than', 5)],
+            criteria('InvoiceDate', 'later_than', 'LAST_3000_DAYS')]
+    original = [rule[0], [rule[1][0], dict(rule[1][1]), dict(rule[1][2])], dict(rule[2])]
+
+    apply_filter(df, rule)
+
+    assert rule == original
+
+
+@pytest.mark.parametrize('operator', ['AND', 'OR', 'NOT'])
+def test_deep_expression(df, apply_filter, operator):
+    # Deeper than the recursion limit, so nested expressions must not be evaluated recursively
+    rule = criteria('Quantity', 'greater_than', 0)
+    expected = matches(df.Quantity > 0)
+    for i in range(3000):
+        if operator == 'NOT':
+            rule = ['NOT', rule]
+            expected = ~expected
+        else:
+            rule = [operator, rule, criteria('Quantity', 'greater_than', i % 50)]
+            expected = expected & matches(df.Quantity > i % 50) if operator == 'AND' \
+                else expected | matches(df.Quantity > i % 50)
+
+    pd.testing.assert_frame_equal(apply_filter(df, rule), df[expected.to_numpy()])
+
+
+def test_compiled_rule_sees_changes_to_dataframe(df):
+    data = df.copy()
+    data_filter = DataFrameFilter(data)
+    rule = data_filter.compile([criteria('Quantity', 'greater_than', 40)])
+    data_filter.filter(rule)
+
+    data['Quantity'] = 0
+
+    assert data_filter.filter(rule).empty
+
+
+@pytest.mark.parametrize('columns', [['Country', 'Quantity'], 'Country'])
+def test_filter_columns(df, apply_filter, columns):
+    rule, reference = CASES['rule_example']
+    expected = df.loc[reference(df).to_numpy(), [columns] if isinstance(columns, str) else columns]
+
+    pd.testing.assert_frame_equal(apply_filter(df, rule, columns=columns), expected)
+
+
+def test_missing_column(df, apply_filter):
+    with pytest.raises(KeyError, match='Missing'):
+        apply_filter(df, ['OR', criteria('Missing', 'equal_to', 1), criteria('Quantity', 'equal_to', 1)])
+
+
+@pytest.mark.parametrize('column', ['Country', 'Category'])
+def test_is_in_rejects_a_string(df, apply_filter, column):
+    with pytest.raises(TypeError):
+        apply_filter(df, [criteria(column, 'is_in', 'small')])
+
+
+@pytest.mark.parametrize('value', ['2020-13-01', '2020-02-30', 'YESTERDAY', 'LAST_X_DAYS'])
+def test_invalid_date(df, apply_filter, value):
+    with pytest.raises(Exception, match='Invalid date value'):
+        apply_filter(df, [criteria('InvoiceDate', 'later_than', value)])